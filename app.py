@@ -1,23 +1,41 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
+import io
+import math
+import csv
 import json
 import uuid
+import click
+from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 from ai_service import generate_caption_and_hashtags, generate_product_description, analyze_image_for_content
+from follow_graph import FollowGraph
+from catalog_facets import CatalogFacets
+from live_events import EventBroker
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'fallback-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///artconnect.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///artconnect.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['PRODUCT_IMPORT_BATCH_SIZE'] = 500
+# Seconds before a worker rebuilds its follow graph, so follows made in other workers show up
+app.config['FOLLOW_GRAPH_MAX_AGE'] = int(os.environ.get('FOLLOW_GRAPH_MAX_AGE', 300))
+app.config['CATALOG_FACETS_MAX_AGE'] = int(os.environ.get('CATALOG_FACETS_MAX_AGE', 300))
+# Live update streams: idle keep-alive interval, max connection lifetime and posts per subscription
+app.config['STREAM_HEARTBEAT'] = 15
+app.config['STREAM_LIFETIME'] = 300
+app.config['STREAM_MAX_POSTS'] = 100
+# Open streams per worker; keep well below gunicorn's --worker-connections so other requests always get through
+app.config['STREAM_MAX_OPEN'] = int(os.environ.get('STREAM_MAX_OPEN', 500))
 
 # Create upload directories
 os.makedirs('static/uploads/posts', exist_ok=True)
@@ -28,6 +46,9 @@ db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+follow_graph = FollowGraph(max_age=app.config['FOLLOW_GRAPH_MAX_AGE'])
+catalog_facets = CatalogFacets(max_age=app.config['CATALOG_FACETS_MAX_AGE'])
+live_events = EventBroker(max_subscribers=app.config['STREAM_MAX_OPEN'])
 
 # Database Models
 class User(UserMixin, db.Model):
@@ -94,6 +115,11 @@ class Post(db.Model):
     
     def is_liked_by(self, user):
         return self.likes.filter_by(user_id=user.id).first() is not None
+    
+    __table_args__ = (
+        db.Index('ix_post_created_at', 'created_at'),
+        db.Index('ix_post_user_id_created_at', 'user_id', 'created_at'),
+    )
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -108,13 +134,24 @@ class Product(db.Model):
     # Relationships
     cart_items = db.relationship('CartItem', backref='product', lazy='dynamic', cascade='all, delete-orphan')
     wishlist_items = db.relationship('WishlistItem', backref='product', lazy='dynamic', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_product_category_created_at', 'category', 'created_at'),
+        db.Index('ix_product_category_price', 'category', 'price'),
+        db.Index('ix_product_price', 'price'),
+        db.Index('ix_product_created_at', 'created_at'),
+        db.Index('ix_product_user_id_created_at', 'user_id', 'created_at'),
+    )
 
 class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    __table_args__ = (db.UniqueConstraint('user_id', 'post_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id'),
+        db.Index('ix_like_post_id_user_id', 'post_id', 'user_id'),
+    )
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -122,13 +159,18 @@ class Comment(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # SQLite appends the rowid (id) to every index, so this also serves the `since` cursor
+    __table_args__ = (db.Index('ix_comment_post_id', 'post_id'),)
 
 class Follow(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    __table_args__ = (db.UniqueConstraint('follower_id', 'followed_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('follower_id', 'followed_id'),
+        db.Index('ix_follow_followed_id_follower_id', 'followed_id', 'follower_id'),
+    )
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -145,6 +187,52 @@ class WishlistItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     __table_args__ = (db.UniqueConstraint('user_id', 'product_id'),)
 
+def get_follow_graph(user_id=None):
+    """Return the process-wide follow graph, bulk loading it from the follow table if stale.
+    
+    Passing ``user_id`` re-reads that user's own follows, which may have been
+    changed through another worker since this worker's graph was loaded.
+    """
+    if not follow_graph.loaded:
+        follow_graph.load(db.session.query(Follow.follower_id, Follow.followed_id).all())
+    elif user_id is not None:
+        follow_graph.set_following(
+            user_id, [followed_id for followed_id, in db.session.query(Follow.followed_id).filter(
+                Follow.follower_id == user_id)]
+        )
+    return follow_graph
+
+def get_catalog_facets():
+    """Return the process-wide marketplace facet counts, reloading them if stale"""
+    if not catalog_facets.loaded:
+        bucket = db.case(
+            *[(Product.price >= low, i) for i, low in reversed(list(enumerate(catalog_facets.bucket_edges)))],
+            else_=0
+        )
+        max_id = db.select(db.func.max(Product.id)).scalar_subquery()
+        catalog_facets.load(
+            lambda: db.session.query(Product.category, bucket, db.func.count(), max_id).group_by(
+                Product.category, bucket
+            ).all()
+        )
+    return catalog_facets
+
+def parse_price_range(value):
+    """Parse a 'low-high' price filter (either side may be empty) into floats or None"""
+    low, sep, high = (value or '').partition('-')
+    if not sep:
+        return None, None
+    try:
+        return (float(low) if low else None), (float(high) if high else None)
+    except ValueError:
+        return None, None
+
+def create_missing_indexes():
+    """Migrate existing databases: create_all() skips existing tables, so add indexes declared since"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -225,7 +313,10 @@ def feed():
     posts = Post.query.order_by(Post.created_at.desc()).paginate(
         page=page, per_page=10, error_out=False
     )
-    return render_template('feed.html', posts=posts)
+    followed_ids = get_follow_graph(current_user.id).following_among(
+        current_user.id, {post.user_id for post in posts.items}
+    )
+    return render_template('feed.html', posts=posts, followed_ids=followed_ids)
 
 @app.route('/profile/<username>')
 @login_required
@@ -288,6 +379,8 @@ def create_post():
     db.session.add(post)
     db.session.commit()
     
+    live_events.publish('post', {'post_id': post.id, 'username': current_user.username})
+    
     return jsonify({
         'success': True,
         'message': 'Post created successfully',
@@ -311,6 +404,8 @@ def toggle_like(post_id):
     db.session.commit()
     like_count = Like.query.filter_by(post_id=post_id).count()
     
+    live_events.publish('like', {'post_id': post_id, 'like_count': like_count}, post_id=post_id)
+    
     return jsonify({
         'success': True,
         'liked': liked,
@@ -338,6 +433,13 @@ def handle_comments(post_id):
         db.session.add(comment)
         db.session.commit()
         
+        comment_count = Comment.query.filter_by(post_id=post_id).count()
+        live_events.publish('comment', {
+            'post_id': post_id,
+            'comment_id': comment.id,
+            'comment_count': comment_count
+        }, post_id=post_id)
+        
         return jsonify({
             'success': True,
             'comment': {
@@ -348,16 +450,63 @@ def handle_comments(post_id):
             }
         }), 201
     
-    # GET comments
-    comments = Comment.query.filter_by(post_id=post_id).order_by(Comment.created_at.asc()).all()
-    return jsonify({
-        'comments': [{
-            'id': c.id,
-            'content': c.content,
-            'username': c.user.username,
-            'created_at': c.created_at.isoformat()
-        } for c in comments]
-    })
+    # GET comments, optionally only those newer than the client's `since` cursor
+    since = request.args.get('since', 0, type=int)
+    
+    # Comments are append-only, so the count and newest id identify the thread's state
+    count, last_id = db.session.query(db.func.count(Comment.id), db.func.max(Comment.id)).filter(
+        Comment.post_id == post_id
+    ).one()
+    etag = f'comments-{post_id}-{count}-{last_id or 0}'
+    
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        comments = db.session.query(Comment, User.username).join(User, Comment.user_id == User.id).filter(
+            Comment.post_id == post_id, Comment.id > since
+        ).order_by(Comment.id.asc()).all()
+        response = jsonify({
+            'comments': [{
+                'id': c.id,
+                'content': c.content,
+                'username': username,
+                'created_at': c.created_at.isoformat()
+            } for c, username in comments],
+            # Taken from the rows themselves: a comment committed after the state query is
+            # returned here, and must not be fetched again on the next delta
+            'cursor': comments[-1][0].id if comments else since
+        })
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/stream')
+@login_required
+def event_stream():
+    post_ids = request.args.get('posts', '')
+    try:
+        post_ids = {int(post_id) for post_id in post_ids.split(',') if post_id.strip()}
+    except ValueError:
+        return jsonify({'error': 'posts must be a comma-separated list of post IDs'}), 400
+    
+    if len(post_ids) > app.config['STREAM_MAX_POSTS']:
+        return jsonify({'error': 'Too many posts in one subscription'}), 400
+    
+    new_posts = request.args.get('new_posts', '1') != '0'
+    subscription = live_events.subscribe(post_ids, new_posts=new_posts)
+    if subscription is None:
+        # Too many open streams: 204 tells EventSource not to reconnect, so the page falls back to reloads
+        return '', 204
+    
+    response = Response(
+        subscription.events(heartbeat=app.config['STREAM_HEARTBEAT'], lifetime=app.config['STREAM_LIFETIME']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when the server closes the response, even if the client left before the first event
+    response.call_on_close(lambda: live_events.unsubscribe(subscription))
+    return response
 
 @app.route('/api/follow/<int:user_id>', methods=['POST'])
 @login_required
@@ -383,6 +532,12 @@ def toggle_follow(user_id):
         following = True
     
     db.session.commit()
+    
+    if following:
+        follow_graph.add(current_user.id, user_id)
+    else:
+        follow_graph.remove(current_user.id, user_id)
+    # Counted from the table: this worker's graph may not have other workers' follows yet
     follower_count = Follow.query.filter_by(followed_id=user_id).count()
     
     return jsonify({
@@ -391,6 +546,45 @@ def toggle_follow(user_id):
         'follower_count': follower_count
     })
 
+@app.route('/api/follow/status')
+@login_required
+def follow_status():
+    user_ids = request.args.get('ids', '')
+    try:
+        user_ids = {int(user_id) for user_id in user_ids.split(',') if user_id.strip()}
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of user IDs'}), 400
+    
+    followed_ids = get_follow_graph(current_user.id).following_among(current_user.id, user_ids)
+    
+    return jsonify({
+        'following': {str(user_id): user_id in followed_ids for user_id in user_ids}
+    })
+
+@app.route('/api/suggestions/artisans')
+@login_required
+def suggest_artisans():
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    ranked = get_follow_graph(current_user.id).suggest(current_user.id, limit=limit)
+    
+    artisans = {}
+    if ranked:
+        artisans = {u.id: u for u in User.query.filter(
+            User.id.in_([artisan_id for artisan_id, _ in ranked]),
+            User.role == 'artisan'
+        )}
+    
+    return jsonify({
+        'artisans': [{
+            'id': artisan_id,
+            'username': artisans[artisan_id].username,
+            'craft_type': artisans[artisan_id].craft_type,
+            'region': artisans[artisan_id].region,
+            'profile_image': artisans[artisan_id].profile_image,
+            'mutual_followers': score
+        } for artisan_id, score in ranked if artisan_id in artisans]
+    })
+
 # Marketplace Routes
 @app.route('/marketplace')
 @login_required
@@ -398,20 +592,113 @@ def marketplace():
     page = request.args.get('page', 1, type=int)
     category = request.args.get('category', '')
     search = request.args.get('search', '')
+    price = request.args.get('price', '')
+    sort = request.args.get('sort', 'newest')
     
     query = Product.query
     
     if category:
         query = query.filter(Product.category == category)
     
+    min_price, max_price = parse_price_range(price)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price < max_price)
+    
     if search:
         query = query.filter(Product.title.contains(search) | Product.description.contains(search))
     
-    products = query.order_by(Product.created_at.desc()).paginate(
+    if sort == 'price_low':
+        query = query.order_by(Product.price.asc(), Product.id.asc())
+    elif sort == 'price_high':
+        query = query.order_by(Product.price.desc(), Product.id.desc())
+    else:
+        sort = 'newest'
+        query = query.order_by(Product.created_at.desc())
+    
+    products = query.paginate(
         page=page, per_page=12, error_out=False
     )
     
-    return render_template('marketplace.html', products=products, category=category, search=search)
+    facets = get_catalog_facets()
+    
+    return render_template(
+        'marketplace.html',
+        products=products,
+        category=category,
+        search=search,
+        price=price,
+        sort=sort,
+        category_counts=dict(facets.category_counts()),
+        price_counts=facets.price_counts(category)
+    )
+
+def validate_product_data(data):
+    """Validate a product payload, returning (fields, None) or (None, error message)"""
+    if not isinstance(data, dict):
+        return None, 'All fields are required'
+    
+    text_fields = {}
+    for field in ('title', 'description', 'image_url', 'category'):
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f'{field} must be a string'
+        text_fields[field] = (value or '').strip()
+    
+    title = text_fields['title']
+    description = text_fields['description']
+    image_url = text_fields['image_url']
+    category = text_fields['category']
+    price = data.get('price')
+    
+    if not all([title, description, image_url]) or price is None or price == '':
+        return None, 'All fields are required'
+    
+    if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+        return None, 'Invalid price format'
+    try:
+        price = float(price)
+    except (ValueError, OverflowError):
+        return None, 'Invalid price format'
+    if not math.isfinite(price):
+        return None, 'Invalid price format'
+    if price <= 0:
+        return None, 'Price must be positive'
+    
+    return {
+        'title': title,
+        'description': description,
+        'price': price,
+        'image_url': image_url,
+        'category': category
+    }, None
+
+def iter_import_rows(stream, import_format):
+    """Yield (line number, row dict or None, error) from a streamed CSV or JSONL body"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    line_num = 0
+    
+    try:
+        if import_format == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                line_num = reader.line_num
+                yield line_num, row, None
+            return
+        
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield line_num, None, 'Invalid JSON'
+                continue
+            yield line_num, data, None
+    except (UnicodeDecodeError, csv.Error) as e:
+        # The rest of the body can't be parsed reliably, so stop at the first malformed line
+        yield line_num + 1, None, f'Unreadable input, import stopped: {e}'
 
 @app.route('/api/products', methods=['POST'])
 @login_required
@@ -419,35 +706,17 @@ def create_product():
     if current_user.role != 'artisan':
         return jsonify({'error': 'Only artisans can create products'}), 403
     
-    data = request.get_json()
-    title = data.get('title', '').strip()
-    description = data.get('description', '').strip()
-    price = data.get('price')
-    image_url = data.get('image_url', '').strip()
-    category = data.get('category', '').strip()
-    
-    if not all([title, description, image_url]) or price is None:
-        return jsonify({'error': 'All fields are required'}), 400
+    fields, error = validate_product_data(request.get_json())
+    if error:
+        return jsonify({'error': error}), 400
     
-    try:
-        price = float(price)
-        if price <= 0:
-            return jsonify({'error': 'Price must be positive'}), 400
-    except (ValueError, TypeError):
-        return jsonify({'error': 'Invalid price format'}), 400
-    
-    product = Product(
-        user_id=current_user.id,
-        title=title,
-        description=description,
-        price=price,
-        image_url=image_url,
-        category=category
-    )
+    product = Product(user_id=current_user.id, **fields)
     
     db.session.add(product)
     db.session.commit()
     
+    catalog_facets.add(product.id, product.category, product.price)
+    
     return jsonify({
         'success': True,
         'product': {
@@ -458,6 +727,83 @@ def create_product():
         }
     }), 201
 
+def insert_product_batch(batch, errors):
+    """Insert and commit one batch of (line number, product fields) rows, returning how many were stored.
+    
+    Facet counts are updated as soon as the batch commits. If the batch fails it is
+    rolled back and each of its lines is reported in ``errors``.
+    """
+    try:
+        result = db.session.execute(
+            db.insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            [fields for _, fields in batch]
+        )
+        product_ids = result.scalars().all()
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        app.logger.exception('Product import batch failed')
+        errors.extend({'line': line_num, 'error': 'Could not save product'} for line_num, _ in batch)
+        return 0
+    
+    for product_id, (_, fields) in zip(product_ids, batch):
+        catalog_facets.add(product_id, fields['category'], fields['price'])
+    return len(product_ids)
+
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+def import_products():
+    if current_user.role != 'artisan':
+        return jsonify({'error': 'Only artisans can create products'}), 403
+    
+    content_type = request.mimetype or ''
+    import_format = request.args.get('format')
+    if not import_format:
+        if content_type in ('text/csv', 'application/csv'):
+            import_format = 'csv'
+        elif content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+            import_format = 'jsonl'
+    if import_format not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Body must be CSV (text/csv) or JSON Lines (application/x-ndjson)'}), 415
+    
+    batch_size = app.config['PRODUCT_IMPORT_BATCH_SIZE']
+    batch = []
+    imported = 0
+    errors = []
+    
+    for line_num, data, error in iter_import_rows(request.stream, import_format):
+        if not error:
+            fields, error = validate_product_data(data)
+        if error:
+            errors.append({'line': line_num, 'error': error})
+            continue
+        
+        fields['user_id'] = current_user.id
+        fields['created_at'] = datetime.utcnow()
+        batch.append((line_num, fields))
+        if len(batch) >= batch_size:
+            imported += insert_product_batch(batch, errors)
+            batch = []
+    
+    if batch:
+        imported += insert_product_batch(batch, errors)
+    
+    if not imported and not errors:
+        return jsonify({
+            'success': False,
+            'error': 'No rows to import',
+            'imported': 0,
+            'failed': 0,
+            'errors': []
+        }), 400
+    
+    return jsonify({
+        'success': not errors,
+        'imported': imported,
+        'failed': len(errors),
+        'errors': errors
+    }), 201 if imported else 400
+
 @app.route('/api/cart/add/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
@@ -629,12 +975,74 @@ def ai_analyze_image():
         'analysis': analysis
     })
 
+# Query plan regression check
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if any hot endpoint query needs a full table scan or a temporary sort.
+
+    Seeds data and issues writes, so run it against an empty scratch database
+    via SQLALCHEMY_DATABASE_URI.
+    """
+    import query_plans
+    
+    if db.engine.url.get_backend_name() != 'sqlite' or db.engine.url.database in (None, '', ':memory:'):
+        raise click.ClickException('check-query-plans needs a SQLite database file it can reopen')
+    if db.session.query(User.id).first() is not None:
+        raise click.ClickException(
+            'check-query-plans seeds and modifies data; point SQLALCHEMY_DATABASE_URI at an empty database'
+        )
+    if not query_plans.check(app, db, click.echo):
+        raise SystemExit(1)
+
+@app.cli.command('check-catalog-facets')
+def check_catalog_facets():
+    """Fail if CatalogFacets miscounts products added out of id order or during a load"""
+    facets = CatalogFacets()
+    facets.load(lambda: [('art', 0, 100, 100)])
+    
+    failures = []
+    
+    def expect(label, expected):
+        actual = dict(facets.category_counts()).get('art', 0)
+        if actual != expected:
+            failures.append(f'{label}: expected {expected}, counted {actual}')
+    
+    facets.add(102, 'art', 10)
+    facets.add(101, 'art', 10)
+    facets.add(102, 'art', 10)
+    expect('out-of-order adds', 102)
+    
+    # A product created with id 111 while an import inserts 103-110 and counts them afterwards
+    facets.add(111, 'art', 10)
+    for product_id in range(103, 111):
+        facets.add(product_id, 'art', 10)
+    expect('import finishing after a later create', 111)
+    
+    def fetch_during_adds():
+        facets.add(112, 'art', 10)  # committed before the read, so the snapshot includes it
+        facets.add(114, 'art', 10)  # committed after the read
+        facets.add(113, 'art', 10)
+        return [('art', 0, 112, 112)]
+    
+    facets.load(fetch_during_adds)
+    facets.add(114, 'art', 10)
+    facets.add(115, 'art', 10)
+    expect('adds racing a reload', 115)
+    
+    for failure in failures:
+        click.echo(f'FAIL {failure}')
+    if failures:
+        raise SystemExit(1)
+    click.echo('CatalogFacets counted every product once')
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        create_missing_indexes()
     # For local development
     app.run(host='0.0.0.0', port=5000, debug=True)
 else:
     # For production (Gunicorn)
     with app.app_context():
-        db.create_all()
\ No newline at end of file
+        db.create_all()
+        create_missing_indexes()
\ No newline at end of file
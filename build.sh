@@ -6,10 +6,19 @@ pip install -r requirements.txt
 
 echo "Setting up database..."
 python -c "
-from app import app, db
+from app import app, db, create_missing_indexes
 with app.app_context():
     db.create_all()
+    create_missing_indexes()
     print('Database tables created successfully!')
 "
 
+echo "Checking marketplace facet counting..."
+python -m flask --app app check-catalog-facets || exit 1
+
+echo "Checking query plans of hot endpoints..."
+PLAN_CHECK_DIR=$(mktemp -d)
+SQLALCHEMY_DATABASE_URI="sqlite:///$PLAN_CHECK_DIR/query_plans.db" python -m flask --app app check-query-plans || exit 1
+rm -rf "$PLAN_CHECK_DIR"
+
 echo "Build completed successfully!"
\ No newline at end of file
@@ -0,0 +1,114 @@
+from collections import defaultdict
+import threading
+import time
+
+# Lower bounds of the marketplace price buckets; the last bucket is open-ended
+PRICE_BUCKET_EDGES = (0, 25, 50, 100, 250)
+
+
+class CatalogFacets:
+    """Category x price-bucket product counts for faceted marketplace browsing.
+
+    Counts are loaded from one GROUP BY and then kept current as products
+    are added, so rendering facets never scans the product table. Each load
+    records the highest product id it saw, and ids added above it are kept
+    in a set, so every product is counted exactly once whatever order adds
+    arrive in and whichever side of a load's read they land.
+    """
+
+    def __init__(self, bucket_edges=PRICE_BUCKET_EDGES, max_age=None):
+        self.bucket_edges = tuple(bucket_edges)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)  # (category, bucket index) -> products
+        self._snapshot_max_id = 0  # highest product id the last load read
+        self._counted_ids = set()  # ids above _snapshot_max_id already added to _counts
+        self._loads_running = 0
+        self._added_during_load = []  # (product_id, key) pairs to replay onto a fresh load
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        if self._loaded_at is None:
+            return False
+        if self.max_age is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.max_age
+
+    @property
+    def buckets(self):
+        """(low, high) price bounds per bucket; ``high`` is None for the last one"""
+        highs = self.bucket_edges[1:] + (None,)
+        return list(zip(self.bucket_edges, highs))
+
+    def bucket_index(self, price):
+        for i in range(len(self.bucket_edges) - 1, -1, -1):
+            if price >= self.bucket_edges[i]:
+                return i
+        return 0
+
+    def load(self, fetch_rows):
+        """Rebuild counts from ``fetch_rows()``.
+
+        It must return (category, bucket index, count, max product id) rows
+        read in a single statement, so the max id matches the counts.
+        """
+        with self._lock:
+            self._loads_running += 1
+        try:
+            rows = fetch_rows()
+        except Exception:
+            with self._lock:
+                self._finish_load()
+            raise
+
+        counts = defaultdict(int)
+        max_product_id = 0
+        for category, bucket, count, max_id in rows:
+            counts[(category or '', bucket)] += count
+            max_product_id = max(max_product_id, max_id or 0)
+
+        with self._lock:
+            counted_ids = set()
+            for product_id, key in self._added_during_load:
+                if product_id > max_product_id and product_id not in counted_ids:
+                    counts[key] += 1
+                    counted_ids.add(product_id)
+            self._counts = counts
+            self._snapshot_max_id = max_product_id
+            self._counted_ids = counted_ids
+            self._loaded_at = time.monotonic()
+            self._finish_load()
+
+    def _finish_load(self):
+        self._loads_running -= 1
+        if not self._loads_running:
+            self._added_during_load = []
+
+    def add(self, product_id, category, price):
+        """Count a newly committed product unless the last load already included it"""
+        key = (category or '', self.bucket_index(price))
+        with self._lock:
+            if self._loads_running:
+                self._added_during_load.append((product_id, key))
+            if product_id > self._snapshot_max_id and product_id not in self._counted_ids:
+                self._counts[key] += 1
+                self._counted_ids.add(product_id)
+
+    def category_counts(self):
+        """Products per non-empty category, largest first"""
+        totals = defaultdict(int)
+        with self._lock:
+            for (category, _), count in self._counts.items():
+                if category:
+                    totals[category] += count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def price_counts(self, category=None):
+        """Products per price bucket as (low, high, count), optionally within one category"""
+        totals = [0] * len(self.bucket_edges)
+        with self._lock:
+            for (product_category, bucket), count in self._counts.items():
+                if not category or product_category == category:
+                    totals[bucket] += count
+        return [(low, high, totals[i]) for i, (low, high) in enumerate(self.buckets)]
@@ -0,0 +1,149 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+import time
+
+
+class FollowGraph:
+    """In-memory index of the follow table for two-hop queries.
+
+    Adjacency is kept in both directions as one sorted ``array('i')`` per
+    user, so membership checks are a binary search and co-follower walks
+    touch contiguous ints instead of ORM rows.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._following = {}  # follower_id -> sorted followed ids
+        self._followers = {}  # followed_id -> sorted follower ids
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        if self._loaded_at is None:
+            return False
+        if self.max_age is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.max_age
+
+    def load(self, edges):
+        """Rebuild the index from an iterable of (follower_id, followed_id) pairs"""
+        edges = sorted(set(edges))
+        following = _build_adjacency(edges)
+        followers = _build_adjacency(sorted((b, a) for a, b in edges))
+
+        with self._lock:
+            self._following = following
+            self._followers = followers
+            self._loaded_at = time.monotonic()
+
+    def add(self, follower_id, followed_id):
+        with self._lock:
+            _insert(self._following, follower_id, followed_id)
+            _insert(self._followers, followed_id, follower_id)
+
+    def remove(self, follower_id, followed_id):
+        with self._lock:
+            _discard(self._following, follower_id, followed_id)
+            _discard(self._followers, followed_id, follower_id)
+
+    def set_following(self, follower_id, followed_ids):
+        """Replace ``follower_id``'s row, e.g. with a fresh read of their own follows"""
+        followed_ids = set(followed_ids)
+        with self._lock:
+            previous = set(self._following.get(follower_id, ()))
+            for followed_id in previous - followed_ids:
+                _discard(self._followers, followed_id, follower_id)
+            for followed_id in followed_ids - previous:
+                _insert(self._followers, followed_id, follower_id)
+            if followed_ids:
+                self._following[follower_id] = array('i', sorted(followed_ids))
+            else:
+                self._following.pop(follower_id, None)
+
+    def is_following(self, follower_id, followed_id):
+        return _contains(self._following.get(follower_id), followed_id)
+
+    def following_among(self, follower_id, user_ids):
+        """Return the subset of ``user_ids`` that ``follower_id`` follows"""
+        ids = self._following.get(follower_id)
+        if not ids:
+            return set()
+        return {user_id for user_id in user_ids if _contains(ids, user_id)}
+
+    def followers_count(self, user_id):
+        return len(self._followers.get(user_id, ()))
+
+    def following_count(self, user_id):
+        return len(self._following.get(user_id, ()))
+
+    def suggest(self, user_id, limit=10):
+        """Rank artisans by how many of ``user_id``'s co-followers follow them.
+
+        A co-follower is anyone who follows at least one artisan that
+        ``user_id`` follows. Returns a list of (artisan_id, score) pairs,
+        highest score first, ties broken by the lower id.
+        """
+        with self._lock:
+            following = self._following.get(user_id)
+            if not following:
+                return []
+
+            co_followers = set()
+            for artisan_id in following:
+                co_followers.update(self._followers.get(artisan_id, ()))
+            co_followers.discard(user_id)
+
+            scores = defaultdict(int)
+            for other_id in co_followers:
+                for artisan_id in self._following.get(other_id, ()):
+                    scores[artisan_id] += 1
+
+        ranked = [
+            (artisan_id, score) for artisan_id, score in scores.items()
+            if artisan_id != user_id and not _contains(following, artisan_id)
+        ]
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+def _build_adjacency(sorted_edges):
+    """Slice a sorted edge list into one compact array per source node (CSR rows)"""
+    targets = array('i', (target for _, target in sorted_edges))
+    adjacency = {}
+    start = 0
+    for i in range(1, len(sorted_edges) + 1):
+        if i == len(sorted_edges) or sorted_edges[i][0] != sorted_edges[start][0]:
+            adjacency[sorted_edges[start][0]] = targets[start:i]
+            start = i
+    return adjacency
+
+
+def _contains(ids, value):
+    if not ids:
+        return False
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+
+def _insert(adjacency, key, value):
+    ids = adjacency.get(key)
+    if ids is None:
+        adjacency[key] = array('i', [value])
+        return
+    i = bisect_left(ids, value)
+    if i == len(ids) or ids[i] != value:
+        ids.insert(i, value)
+
+
+def _discard(adjacency, key, value):
+    ids = adjacency.get(key)
+    if not ids:
+        return
+    i = bisect_left(ids, value)
+    if i < len(ids) and ids[i] == value:
+        del ids[i]
+        if not ids:
+            del adjacency[key]
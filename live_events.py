@@ -0,0 +1,95 @@
+from collections import defaultdict
+import json
+import queue
+import threading
+import time
+
+
+class Subscription:
+    """One client's event queue, limited to the posts it has on screen"""
+
+    def __init__(self, post_ids, new_posts, max_queue):
+        self.post_ids = frozenset(post_ids)
+        self.new_posts = new_posts
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def events(self, heartbeat=15, lifetime=300):
+        """Yield server-sent event frames until ``lifetime`` seconds have passed.
+
+        A comment line is sent every ``heartbeat`` seconds of silence so dead
+        connections are noticed; the browser's EventSource reconnects on its
+        own once the stream ends.
+        """
+        deadline = time.monotonic() + lifetime
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            if self.overflowed:
+                # Events were dropped, so the client has to re-read the page state
+                yield format_event('resync', {})
+                return
+            try:
+                event_type, data = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(event_type, data)
+
+
+class EventBroker:
+    """In-process pub/sub fanning events out to the SSE streams of this worker.
+
+    Events only reach subscribers in the publishing process, so the Procfile
+    runs a single gevent worker that holds every stream; running more workers
+    would need a relay between them.
+    """
+
+    def __init__(self, max_queue=100, max_subscribers=None):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._by_post = defaultdict(set)  # post_id -> subscriptions watching it
+        self._new_posts = set()  # subscriptions that want new-post events
+
+    def subscribe(self, post_ids, new_posts=True):
+        """Register a subscription, or return None if ``max_subscribers`` are already open"""
+        subscription = Subscription(post_ids, new_posts, self.max_queue)
+        with self._lock:
+            if self.max_subscribers is not None and len(self._subscriptions) >= self.max_subscribers:
+                return None
+            self._subscriptions.add(subscription)
+            for post_id in subscription.post_ids:
+                self._by_post[post_id].add(subscription)
+            if new_posts:
+                self._new_posts.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            for post_id in subscription.post_ids:
+                subscribers = self._by_post.get(post_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_post[post_id]
+            self._new_posts.discard(subscription)
+
+    def publish(self, event_type, data, post_id=None):
+        """Queue an event for everyone watching ``post_id``, or for all new-post subscribers"""
+        with self._lock:
+            if post_id is None:
+                subscribers = list(self._new_posts)
+            else:
+                subscribers = list(self._by_post.get(post_id, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event_type, data))
+            except queue.Full:
+                subscription.overflowed = True
+
+
+def format_event(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
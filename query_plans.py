@@ -0,0 +1,250 @@
+import re
+import sqlite3
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+# Plans allowed to scan or sort, by name: (request labels or None, statement
+# pattern or None, reason). Every other statement must reach its rows through
+# an index search, or walk an index that serves its ORDER BY under a LIMIT.
+ALLOWED = {
+    'LIKE search': (
+        {'search', 'marketplace search'}, None,
+        "LIKE '%term%' can't use a B-tree index"
+    ),
+    'price range sorted by newest': (
+        {'marketplace price range newest', 'marketplace category price range newest'}, None,
+        'a price range and a created_at ordering cannot share one index; only the rows in the range are sorted'
+    ),
+    'unfiltered pagination totals': (
+        None, re.compile(r'^SELECT count\(\*\) AS count_1 FROM \(SELECT .* FROM (post|product)\) AS anon_1$'),
+        'the total of an unfiltered feed or marketplace listing counts every row; SQLite reads the smallest index'
+    ),
+}
+
+# Dropped by the self-check, which expects the check to fail without it
+SELF_CHECK_INDEX = 'ix_like_post_id_user_id'
+
+MARKETPLACE_VIEWS = {
+    'marketplace newest': '',
+    'marketplace page 2': 'page=2',
+    'marketplace category newest': 'category=pottery',
+    'marketplace price low': 'sort=price_low',
+    'marketplace price high': 'sort=price_high',
+    'marketplace price range newest': 'price=25-50',
+    'marketplace price range price low': 'price=25-50&sort=price_low',
+    'marketplace open price range': 'price=250-&sort=price_high',
+    'marketplace category price low': 'category=pottery&sort=price_low',
+    'marketplace category price range newest': 'category=pottery&price=25-50',
+    'marketplace category price range price high': 'category=pottery&price=25-50&sort=price_high',
+    'marketplace search': 'search=vase',
+}
+
+
+def seed(db):
+    """Create a small catalog, feed and social graph to drive the endpoints against"""
+    from app import User, Post, Product, Like, Comment, Follow
+
+    users = {}
+    for username, role in [('artisan1', 'artisan'), ('artisan2', 'artisan'), ('artisan3', 'artisan'),
+                           ('buyer1', 'buyer'), ('buyer2', 'buyer')]:
+        users[username] = User(
+            username=username,
+            email=f'{username}@example.com',
+            password_hash=generate_password_hash('password'),
+            role=role
+        )
+        db.session.add(users[username])
+    db.session.flush()
+
+    artisans = [users['artisan1'], users['artisan2'], users['artisan3']]
+    posts = [Post(user_id=artisans[i % 3].id, image_url=f'/static/{i}.jpg', caption='Handmade')
+             for i in range(25)]
+    db.session.add_all(posts)
+    categories = ['pottery', 'jewelry', 'textiles', 'woodwork', 'art', 'other']
+    db.session.add_all(
+        Product(user_id=artisans[i % 3].id, title=f'Vase {i}', description='Handmade', price=10 + i * 7,
+                image_url=f'/static/p{i}.jpg', category=categories[i % len(categories)])
+        for i in range(40)
+    )
+    db.session.flush()
+
+    for post in posts[:5]:
+        db.session.add(Like(user_id=users['buyer2'].id, post_id=post.id))
+        db.session.add(Comment(user_id=users['buyer2'].id, post_id=post.id, content='Lovely'))
+    for follower, followed in [('buyer1', 'artisan1'), ('buyer2', 'artisan1'), ('buyer2', 'artisan2')]:
+        db.session.add(Follow(follower_id=users[follower].id, followed_id=users[followed].id))
+    db.session.commit()
+    return {name: user.id for name, user in users.items()}
+
+
+def hot_requests(user_ids):
+    """(label, username, method, url, request kwargs) for every hot endpoint"""
+    buyer = [
+        ('feed', 'GET', '/feed', {}),
+        ('feed page 2', 'GET', '/feed?page=2', {}),
+        ('profile', 'GET', '/profile/artisan1', {}),
+        ('like', 'POST', '/api/posts/1/like', {}),
+        ('comments', 'GET', '/api/posts/1/comments', {}),
+        ('comments since', 'GET', '/api/posts/1/comments?since=1', {}),
+        ('add comment', 'POST', '/api/posts/1/comments', {'json': {'content': 'Beautiful'}}),
+        ('follow', 'POST', f"/api/follow/{user_ids['artisan2']}", {}),
+        ('follow status', 'GET', f"/api/follow/status?ids={user_ids['artisan1']},{user_ids['artisan2']}", {}),
+        ('artisan suggestions', 'GET', '/api/suggestions/artisans', {}),
+        ('add to cart', 'POST', '/api/cart/add/1', {}),
+        ('add to wishlist', 'POST', '/api/wishlist/add/2', {}),
+        ('cart', 'GET', '/cart', {}),
+        ('search', 'GET', '/api/search?q=vase', {}),
+    ]
+    buyer += [(label, 'GET', f'/marketplace?{query}', {}) for label, query in MARKETPLACE_VIEWS.items()]
+    artisan = [
+        ('create post', 'POST', '/api/posts', {'json': {'image_url': '/static/new.jpg'}}),
+        ('create product', 'POST', '/api/products', {'json': {
+            'title': 'Bowl', 'description': 'Handmade', 'price': 20, 'image_url': '/static/b.jpg'
+        }}),
+        ('import products', 'POST', '/api/products/import', {
+            'data': '{"title": "Cup", "description": "Handmade", "price": 5, "image_url": "/c.jpg"}\n',
+            'content_type': 'application/x-ndjson'
+        }),
+    ]
+    return [('buyer1',) + request for request in buyer] + [('artisan1',) + request for request in artisan]
+
+
+def capture_statements(app, db, user_ids):
+    """Issue every hot request through the test client, recording (label, SQL, parameters)"""
+    captured = []
+    current = {'label': None}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if current['label'] and not executemany and verb in ('SELECT', 'UPDATE', 'DELETE'):
+            captured.append((current['label'], statement, parameters))
+
+    client = app.test_client()
+    logged_in = None
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for username, label, method, url, kwargs in hot_requests(user_ids):
+            if username != logged_in:
+                client.get('/logout')
+                current['label'] = 'login'
+                client.post('/login', json={'username': username, 'password': 'password'})
+                logged_in = username
+            current['label'] = label
+            response = client.open(url, method=method, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{label}: {method} {url} returned {response.status_code}')
+            current['label'] = None
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return captured
+
+
+def _order_by_columns(statement):
+    """Column names of the outermost ORDER BY, without table prefixes or directions"""
+    matches = re.findall(r' ORDER BY (.+?)(?= LIMIT | OFFSET |\)|$)', statement)
+    if not matches:
+        return []
+    columns = []
+    for term in matches[-1].split(','):
+        column = term.strip().split()[0]
+        columns.append(column.rsplit('.', 1)[-1].strip('"'))
+    return columns
+
+
+def _serves_order_by(conn, statement, index_name):
+    """True if walking ``index_name`` returns rows already in the statement's ORDER BY order"""
+    order_by = _order_by_columns(statement)
+    if not order_by or ' LIMIT ' not in statement:
+        return False
+    if index_name == 'INTEGER PRIMARY KEY':
+        index_columns = []
+    else:
+        index_columns = [row[2] for row in conn.execute(f'PRAGMA index_info("{index_name}")')]
+    # Every SQLite index ends with the rowid, which is the id column here
+    return order_by == (index_columns + ['id'])[:len(order_by)]
+
+
+def plan_problems(conn, statement, parameters):
+    """Return the EXPLAIN QUERY PLAN lines showing a table or index scan, or a temp B-tree sort"""
+    statement = ' '.join(statement.split())
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+
+    problems = []
+    for row in plan:
+        detail = row[-1]
+        if 'TEMP B-TREE' in detail:
+            problems.append(detail)
+        elif detail.startswith('SCAN ') and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (')):
+            # "SCAN t USING INDEX ix" is also a full walk; it's only cheap when ix gives
+            # the ORDER BY and a LIMIT stops the walk early
+            using = re.search(r'USING (?:COVERING )?(INDEX (\S+)|INTEGER PRIMARY KEY)', detail)
+            index_name = using and (using.group(2) or 'INTEGER PRIMARY KEY')
+            if not index_name or not _serves_order_by(conn, statement, index_name):
+                problems.append(detail)
+    return problems
+
+
+def allowed_reason(label, statement):
+    statement = ' '.join(statement.split())
+    for name, (labels, pattern, reason) in ALLOWED.items():
+        if (labels is None or label in labels) and (pattern is None or pattern.match(statement)):
+            return f'{name}: {reason}'
+    return None
+
+
+def find_problems(database, captured):
+    """Yield (label, statement, problems, allowed reason) for every captured statement with a bad plan"""
+    conn = sqlite3.connect(database)
+    try:
+        seen = set()
+        for label, statement, parameters in captured:
+            if (label, statement) in seen:
+                continue
+            seen.add((label, statement))
+            problems = plan_problems(conn, statement, parameters)
+            if problems:
+                yield label, statement, problems, allowed_reason(label, statement)
+    finally:
+        conn.close()
+
+
+def check(app, db, echo):
+    """Seed the (empty) database, drive the hot endpoints and EXPLAIN every statement they issue.
+
+    Returns True when no statement outside ALLOWED scans or sorts, and the
+    check itself notices when SELF_CHECK_INDEX is dropped.
+    """
+    from app import get_follow_graph, get_catalog_facets
+
+    database = db.engine.url.database
+    user_ids = seed(db)
+    # The follow graph and facet counts are bulk loads that scan by design; load them up front
+    get_follow_graph()
+    get_catalog_facets()
+    captured = capture_statements(app, db, user_ids)
+    db.session.remove()
+
+    ok = True
+    for label, statement, problems, reason in find_problems(database, captured):
+        if reason:
+            echo(f'allowed {label}: {"; ".join(problems)} ({reason})')
+        else:
+            ok = False
+            echo(f'FAIL {label}: {"; ".join(problems)}\n    {" ".join(statement.split())}')
+
+    labels = {label for label, _, _ in captured}
+    statements = {(label, statement) for label, statement, _ in captured}
+    echo(f'Checked {len(statements)} statements from {len(labels)} requests')
+
+    # Self-check: the same statements must fail once an index they rely on is gone
+    conn = sqlite3.connect(database)
+    conn.execute(f'DROP INDEX IF EXISTS "{SELF_CHECK_INDEX}"')
+    conn.commit()
+    conn.close()
+    if any(not reason for _, _, _, reason in find_problems(database, captured)):
+        echo(f'Self-check ok: dropping {SELF_CHECK_INDEX} is reported')
+    else:
+        ok = False
+        echo(f'FAIL self-check: dropping {SELF_CHECK_INDEX} went unnoticed')
+    return ok
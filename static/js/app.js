@@ -45,6 +45,35 @@ function toggleLike(postId) {
     });
 }
 
+// Per-post comment cache: after the first load only newer comments are fetched,
+// and an unchanged thread comes back as a 304 with no body
+const commentsCache = {};
+
+async function loadComments(postId) {
+    const cached = commentsCache[postId] || (commentsCache[postId] = { comments: [], cursor: 0, etag: null });
+    const headers = {};
+    if (cached.etag) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    
+    const response = await fetch(`/api/posts/${postId}/comments?since=${cached.cursor}`, { headers });
+    if (response.status === 304) {
+        return cached.comments;
+    }
+    if (!response.ok) {
+        throw new Error(`Failed to load comments (${response.status})`);
+    }
+    
+    const data = await response.json();
+    // Another load for this post may have finished first; skip anything already cached
+    const lastCachedId = cached.comments.length ? cached.comments[cached.comments.length - 1].id : 0;
+    const newComments = (data.comments || []).filter(comment => comment.id > lastCachedId);
+    cached.comments = cached.comments.concat(newComments);
+    cached.cursor = Math.max(cached.cursor, data.cursor || 0, lastCachedId);
+    cached.etag = response.headers.get('ETag');
+    return cached.comments;
+}
+
 function showComments(postId) {
     // Create a modal or expand comments section
     const commentText = prompt('Add a comment:');
@@ -186,6 +215,21 @@ function toggleFollow(userId) {
     });
 }
 
+// Live updates: listen for like, comment and new-post events for the given posts.
+// `handlers` maps event types ('like', 'comment', 'post', 'resync') to callbacks.
+function subscribeLiveUpdates(postIds, handlers) {
+    if (!window.EventSource) {
+        return null;
+    }
+    
+    const params = new URLSearchParams({ posts: postIds.join(',') });
+    const source = new EventSource(`/api/stream?${params}`);
+    Object.entries(handlers).forEach(([eventType, handler]) => {
+        source.addEventListener(eventType, event => handler(JSON.parse(event.data)));
+    });
+    return source;
+}
+
 // Initialize when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     console.log('ArtConnect app initialized');